@@ -1,103 +1,525 @@
+import heapq
+import io
 import pickle
+import re
+import sys
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
+from multiprocessing import Pool
 import boto3
-from tqdm.notebook import tqdm
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    # FxHash multiplier, the product's upper bits index the table
+    _FX_SEED = np.uint64(0x9E3779B97F4A7C15)
+
+    @njit(cache=True)
+    def _lookup(keys, key):
+        """
+        Finds the slot of a key in an open-addressing table, or the empty slot it belongs in.
+
+        Parameters:
+            keys (np.ndarray): The keys of the table, -1 marking empty slots. Its size is a power of two.
+            key (int): The packed pair to look up.
+
+        Returns:
+            int: The index of the slot.
+        """
+        mask = len(keys) - 1
+        i = np.int64((np.uint64(key) * _FX_SEED) >> np.uint64(32)) & mask
+        while keys[i] != -1 and keys[i] != key:
+            i = (i + 1) & mask
+        return i
+
+    @njit(cache=True)
+    def _grow(keys, ids):
+        """
+        Rehashes an open-addressing table into one twice its size.
+
+        Parameters:
+            keys (np.ndarray): The keys of the table, -1 marking empty slots.
+            ids (np.ndarray): The dense id stored with every key.
+
+        Returns:
+            tuple: The keys and ids of the new table.
+        """
+        new_keys = np.full(2 * len(keys), -1, dtype=np.int64)
+        new_ids = np.empty(2 * len(keys), dtype=np.int64)
+        for slot in range(len(keys)):
+            if keys[slot] != -1:
+                i = _lookup(new_keys, keys[slot])
+                new_keys[i] = keys[slot]
+                new_ids[i] = ids[slot]
+        return new_keys, new_ids
+
+    @njit(cache=True)
+    def _count_pairs(sym, offsets, freq, size):
+        """
+        Counts pairs of consecutive symbol ids over a flattened vocabulary. Every distinct pair
+        gets a dense id through an open-addressing table, which doubles once it is half full.
+
+        Parameters:
+            sym (np.ndarray): The concatenated symbol ids of all words.
+            offsets (np.ndarray): The start index of every word in sym, followed by len(sym).
+            freq (np.ndarray): The frequency of every word.
+            size (int): The initial size of the table, a power of two.
+
+        Returns:
+            tuple: The key of every pair packed as a << 32 | b and its count, indexed by pair id,
+            then the pair id and the word id of every pair position.
+        """
+        positions = len(sym) - (len(offsets) - 1)
+        keys = np.full(size, -1, dtype=np.int64)
+        ids = np.empty(size, dtype=np.int64)
+        pair_keys = np.empty(size // 2, dtype=np.int64)
+        counts = np.zeros(size // 2, dtype=np.int64)
+        pair_ids = np.empty(positions, dtype=np.int64)
+        wids = np.empty(positions, dtype=np.int64)
+        n = 0
+        p = 0
+        for w in range(len(offsets) - 1):
+            for i in range(offsets[w], offsets[w+1] - 1):
+                key = (np.int64(sym[i]) << 32) | sym[i+1]
+                slot = _lookup(keys, key)
+                if keys[slot] == -1:
+                    if n == len(pair_keys):
+                        keys, ids = _grow(keys, ids)
+                        pair_keys = np.concatenate((pair_keys, np.empty(n, dtype=np.int64)))
+                        counts = np.concatenate((counts, np.zeros(n, dtype=np.int64)))
+                        slot = _lookup(keys, key)
+                    keys[slot] = key
+                    ids[slot] = n
+                    pair_keys[n] = key
+                    n += 1
+                counts[ids[slot]] += freq[w]
+                pair_ids[p] = ids[slot]
+                wids[p] = w
+                p += 1
+        return pair_keys[:n], counts[:n], pair_ids, wids
+
+    @njit(cache=True)
+    def _group_words(pair_ids, wids, n):
+        """
+        Groups the word ids of the pair positions by pair id with a counting sort,
+        keeping each word once per pair.
+
+        Parameters:
+            pair_ids (np.ndarray): The pair id of every pair position.
+            wids (np.ndarray): The word id of every pair position, in increasing order.
+            n (int): The number of pair ids.
+
+        Returns:
+            tuple: The start of every pair's group in the grouped word ids, followed by their
+            total, and the grouped word ids.
+        """
+        last = np.full(n, -1, dtype=np.int64)
+        starts = np.zeros(n + 1, dtype=np.int64)
+        for p in range(len(pair_ids)):
+            if last[pair_ids[p]] != wids[p]:
+                last[pair_ids[p]] = wids[p]
+                starts[pair_ids[p] + 1] += 1
+        for pair_id in range(n):
+            starts[pair_id + 1] += starts[pair_id]
+
+        grouped = np.empty(starts[n], dtype=np.int64)
+        fill = starts[:n].copy()
+        last[:] = -1
+        for p in range(len(pair_ids)):
+            if last[pair_ids[p]] != wids[p]:
+                last[pair_ids[p]] = wids[p]
+                grouped[fill[pair_ids[p]]] = wids[p]
+                fill[pair_ids[p]] += 1
+        return starts, grouped
+
+
+# first bytes of a zstd frame, used to tell compressed models from plain pickles
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# number of sentences sent to a worker process at a time
+_CHUNK_SIZE = 100000
+
+
+def _count_words(chunk):
+    """
+    Counts the words of a chunk of the corpus, run in the worker processes of BPE.train.
+    """
+    counts = Counter()
+    for sentence in chunk:
+        counts.update(sentence.split())
+    return counts
+
+
+class _TrieNode:
+    __slots__ = ("children", "is_token")
+
+    def __init__(self):
+        self.children = {}
+        self.is_token = False
+
+
+def _trie_pattern(node):
+    """
+    Builds a regex alternation from a trie node, matching the longest token below it.
+    Children are tried first, so the regex only backtracks to shorter tokens when it has to.
+    """
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in node.children.items()]
+    if not alternatives:
+        return ""
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    return pattern + "?" if node.is_token else pattern
 
 
 class BPE:
     def __init__(self):
         self.vocab = {}
         self.bpe_codes = {}
-
-    def train(self, corpus, vocab_size, max_merges):
+        self.symbols = []
+        self.sym2id = {}
+        self.words = []
+        self.freqs = []
+        self.pair_counts = {}
+        self.pair_where = {}
+        self._total_token_len = 0
+        self._stats_key = (id(self.bpe_codes), 0)
+        self._cache_key = None
+        self._tokens = None
+        self._trie = None
+        self._pattern = None
+        self._automaton = None
+
+    def train(self, corpus, vocab_size, max_merges, workers=1, verbose=True):
         """
         Trains the model on a given corpus to build the vocabulary and create BPE codes.
 
         Parameters:
-            corpus (list): A list of sentences representing the corpus.
+            corpus (iterable): The sentences of the corpus, iterated over once.
+            workers (int): The number of processes used to build the vocabulary.
+            verbose (bool): Whether to show a progress bar over the merges, if tqdm is installed.
 
         Returns:
             None
         """
         # Build vocabulary
-        for sentence in tqdm(corpus, desc="Building vocabulary"):
-            for word in sentence.split():
-                if word not in self.vocab:
-                    self.vocab[word] = 0
-                self.vocab[word] += 1
-
-        # split vocabulary into chars
-        new_vocab = {}
-        for word, freq in tqdm(self.vocab.items(), desc="Splitting vocabulary"):
-            new_word = ' '.join(word)
-            new_vocab[new_word] = freq
-        self.vocab = new_vocab
+        if workers > 1:
+            sentences = iter(corpus)
+            chunks = iter(lambda: list(islice(sentences, _CHUNK_SIZE)), [])
+            self.vocab = Counter()
+            with Pool(workers) as pool:
+                for part in pool.imap_unordered(_count_words, chunks):
+                    self.vocab.update(part)
+        else:
+            self.vocab = _count_words(corpus)
+
+        # split vocabulary into symbol ids
+        self.symbols = []
+        self.sym2id = {}
+        self.words = []
+        self.freqs = []
+        for word, freq in self.vocab.items():
+            self.words.append(array('i', map(self.get_symbol_id, word)))
+            self.freqs.append(freq)
+
+        # Count pairs once, merges keep the counts up to date
+        self.pair_counts, self.pair_where = self.get_pairs()
+        heap = self.get_pair_heap()
 
         # Create BPE codes
-        for _ in tqdm(range(max_merges), desc="Creating BPE codes"):
-            if len(self.vocab) >= vocab_size:
+        merges = range(max_merges)
+        if verbose:
+            try:
+                from tqdm.auto import tqdm
+                merges = tqdm(merges, desc="Creating BPE codes")
+            except ImportError:
+                pass
+        for _ in merges:
+            if len(self.words) >= vocab_size:
                 print("Vocab size reached.")
                 break
-            pairs = self.get_pairs()
-            if not pairs:
+            best_pair = self.pop_best_pair(heap)
+            if best_pair is None:
                 break
-            best_pair = max(pairs, key=pairs.get)
-            if pairs[best_pair] <= 1:
+            if self.pair_counts[best_pair] <= 1:
                 break
-            self.merge_tokens(*best_pair)
+            for pair in self.merge_tokens(best_pair >> 32, best_pair & 0xFFFFFFFF):
+                if pair in self.pair_counts:
+                    heapq.heappush(heap, (-self.pair_counts[pair], pair))
+            # drop the stale entries once they outnumber the live ones
+            if len(heap) > 2 * len(self.pair_counts):
+                heap = self.get_pair_heap()
+
+        self.vocab = {
+            tuple(self.symbols[symbol] for symbol in word): freq
+            for word, freq in zip(self.words, self.freqs)
+        }
+
+        # the words and pair index are only needed while training
+        self.words = []
+        self.freqs = []
+        self.pair_counts = {}
+        self.pair_where = {}
+
+    def get_pair_heap(self):
+        """
+        Builds a max-heap of the current pair counts.
+
+        Returns:
+            list: A heap of (-count, pair) entries.
+        """
+        heap = [(-count, pair) for pair, count in self.pair_counts.items()]
+        heapq.heapify(heap)
+        return heap
+
+    def pop_best_pair(self, heap):
+        """
+        Pops the most frequent pair from the heap. Entries whose count no longer matches
+        the pair counts are stale and are skipped instead of being removed on update.
+        Ties go to the smallest packed pair, that is the pair whose symbols were registered
+        first, not to the pair seen first in the vocabulary, so tied merges can be taken in
+        a different order than with a full rescan of the pairs.
+
+        Parameters:
+            heap (list): A heap of (-count, pair) entries.
+
+        Returns:
+            int: The most frequent packed pair, or None if the heap is exhausted.
+        """
+        while heap:
+            neg_count, pair = heapq.heappop(heap)
+            if -neg_count == self.pair_counts.get(pair):
+                return pair
+        return None
+
+    def get_symbol_id(self, symbol):
+        """
+        Returns the id of a symbol, registering it in the symbols table if it is new.
+
+        Parameters:
+            symbol (str): The symbol to look up.
+
+        Returns:
+            int: The id of the symbol.
+        """
+        if symbol not in self.sym2id:
+            symbol = sys.intern(symbol)
+            self.sym2id[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.sym2id[symbol]
 
     def get_pairs(self):
         """
-        Generates pairs of consecutive symbols from the given vocabulary and their frequencies.
+        Generates pairs of consecutive symbol ids from the given vocabulary and their frequencies.
+        A pair (a, b) is packed into the single int a << 32 | b.
 
         Returns:
-            dict: A dictionary containing pairs of symbols as keys and their frequencies as values.
+            tuple: A dictionary containing packed pairs as keys and their frequencies as values,
+            and a dictionary mapping each packed pair to the set of word ids containing it.
         """
-        pairs = {}
-        for word, freq in self.vocab.items():
-            symbols = word.split()
-            for i in range(len(symbols)-1):
-                pair = (symbols[i], symbols[i+1])
-                if pair not in pairs:
-                    pairs[pair] = 0
-                pairs[pair] += freq
-        return pairs
+        if njit is None:
+            pairs = defaultdict(int)
+            where = defaultdict(set)
+            for wid, (word, freq) in enumerate(zip(self.words, self.freqs)):
+                for i in range(len(word)-1):
+                    pair = (word[i] << 32) | word[i+1]
+                    pairs[pair] += freq
+                    where[pair].add(wid)
+            return dict(pairs), dict(where)
+
+        offsets = np.zeros(len(self.words) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, self.words), dtype=np.int64, count=len(self.words)), out=offsets[1:])
+        flat = array('i')
+        for word in self.words:
+            flat.extend(word)
+        sym = np.frombuffer(flat, dtype=np.intc)
+        freq = np.array(self.freqs, dtype=np.int64)
+        positions = len(sym) - len(self.words)
+        # a few pairs per symbol is a typical start, the table doubles when it fills up
+        expected = min(positions, 4 * len(self.symbols))
+        size = 1 << (2 * max(1, expected)).bit_length()
+        pair_keys, counts, pair_ids, wids = _count_pairs(sym, offsets, freq, size)
+        pair_keys = pair_keys.tolist()
+        pairs = dict(zip(pair_keys, counts.tolist()))
+
+        starts, grouped = _group_words(pair_ids, wids, len(pair_keys))
+        starts = starts.tolist()
+        grouped = grouped.tolist()
+        where = {key: set(grouped[starts[i]:starts[i+1]]) for i, key in enumerate(pair_keys)}
+        return pairs, where
 
     def merge_tokens(self, token1, token2):
         """
         Merges two tokens and updates the BPE codes and vocabulary.
 
         Parameters:
-            token1 (str): The first token to be merged.
-            token2 (str): The second token to be merged.
+            token1 (int): The id of the first token to be merged.
+            token2 (int): The id of the second token to be merged.
 
         Returns:
-            None
+            set: The packed pairs whose counts changed.
         """
-        new_token = token1 + token2
-        self.bpe_codes[token1 + ' ' + token2] = new_token
-        self.update_vocab(token1, token2, new_token)
-
-    def update_vocab(self, token1, token2, new_token):
+        symbol1, symbol2 = self.symbols[token1], self.symbols[token2]
+        new_token = symbol1 + symbol2
+        # the running total is only extended while it matches the codes, get_stats recomputes it otherwise
+        stats_key = (id(self.bpe_codes), len(self.bpe_codes))
+        self.bpe_codes[symbol1 + ' ' + symbol2] = new_token
+        # a code seen in an earlier training maps to the same token and leaves the total as is
+        if stats_key == self._stats_key and len(self.bpe_codes) > stats_key[1]:
+            self._total_token_len += len(new_token)
+            self._stats_key = (id(self.bpe_codes), len(self.bpe_codes))
+        self.get_symbol_id(new_token)
+        return self.update_vocab((token1 << 32) | token2)
+
+    def update_vocab(self, pair):
         """
-        Update the vocabulary by replacing occurrences of a pair of tokens with a new token.
+        Update the words containing a pair of tokens by replacing it with its merged token,
+        adjusting only the counts of the pairs destroyed and created by the merge.
 
         Args:
-            token1 (str): The first token in the pair.
-            token2 (str): The second token in the pair.
-            new_token (str): The new token to replace the pair.
+            pair (int): The packed ids of the pair of tokens.
 
         Returns:
-            None
+            set: The packed pairs whose counts changed.
         """
-        updated_vocab = {}
-        for word, freq in self.vocab.items():
-            updated_word = word.replace(token1 + ' ' + token2, new_token)
-            updated_vocab[updated_word] = freq
-        self.vocab = updated_vocab
+        token1, token2 = pair >> 32, pair & 0xFFFFFFFF
+        new_token = self.sym2id[self.symbols[token1] + self.symbols[token2]]
+        deltas = defaultdict(int)
+        for wid in self.pair_where.pop(pair):
+            word = self.words[wid]
+            freq = self.freqs[wid]
+            last = len(word) - 1
+            merged = False
+            i = j = 0
+            # rewrite the word in place, j is the write position
+            while i <= last:
+                if i < last and word[i] == token1 and word[i+1] == token2:
+                    deltas[pair] -= freq
+                    if j:
+                        prev = word[j-1]
+                        # (token2, token1) was already removed by the previous merge
+                        if not merged:
+                            deltas[(prev << 32) | token1] -= freq
+                        deltas[(prev << 32) | new_token] += freq
+                        self.pair_where.setdefault((prev << 32) | new_token, set()).add(wid)
+                    if i+1 < last:
+                        nxt = word[i+2]
+                        deltas[(token2 << 32) | nxt] -= freq
+                        # the next merge adds (new_token, new_token) itself
+                        if not (nxt == token1 and i+2 < last and word[i+3] == token2):
+                            deltas[(new_token << 32) | nxt] += freq
+                            self.pair_where.setdefault((new_token << 32) | nxt, set()).add(wid)
+                    word[j] = new_token
+                    merged = True
+                    i += 2
+                else:
+                    word[j] = word[i]
+                    merged = False
+                    i += 1
+                j += 1
+            del word[j:]
+
+        changed = set()
+        for changed_pair, delta in deltas.items():
+            if not delta:
+                continue
+            changed.add(changed_pair)
+            count = self.pair_counts.get(changed_pair, 0) + delta
+            if count:
+                self.pair_counts[changed_pair] = count
+            else:
+                del self.pair_counts[changed_pair]
+                self.pair_where.pop(changed_pair, None)
+        return changed
+
+    def check_caches(self):
+        """
+        Clears the caches built from the BPE codes if the codes were replaced or changed size,
+        whether by training or by assigning bpe_codes directly.
+        """
+        cache_key = (id(self.bpe_codes), len(self.bpe_codes))
+        if cache_key != self._cache_key:
+            self._cache_key = cache_key
+            self._tokens = None
+            self._trie = None
+            self._pattern = None
+            self._automaton = None
+
+    def get_tokens(self):
+        """
+        Get the set of merged tokens, cached until the BPE codes change.
+
+        Returns:
+            frozenset: The values of the BPE codes.
+        """
+        self.check_caches()
+        if self._tokens is None:
+            self._tokens = frozenset(self.bpe_codes.values())
+        return self._tokens
+
+    def get_trie(self):
+        """
+        Get a character trie of the merged tokens, cached until the BPE codes change.
+
+        Returns:
+            _TrieNode: The root of the trie.
+        """
+        self.check_caches()
+        if self._trie is None:
+            self._trie = _TrieNode()
+            for token in self.get_tokens():
+                node = self._trie
+                for char in token:
+                    if char not in node.children:
+                        node.children[char] = _TrieNode()
+                    node = node.children[char]
+                node.is_token = True
+        return self._trie
+
+    def get_pattern(self):
+        """
+        Get a compiled regex matching the longest merged token, or else a single non-space
+        character, at each position. Cached until the BPE codes change.
+
+        Returns:
+            Pattern: The compiled pattern.
+        """
+        self.check_caches()
+        if self._pattern is None:
+            tokens = _trie_pattern(self.get_trie())
+            self._pattern = re.compile(tokens + r"|\S" if tokens else r"\S")
+        return self._pattern
+
+    def get_automaton(self):
+        """
+        Get an Aho-Corasick automaton of the merged tokens, cached until the BPE codes change.
+
+        Returns:
+            ahocorasick.Automaton: The automaton, or None if pyahocorasick is not installed
+            or there are no merged tokens.
+        """
+        self.check_caches()
+        if self._automaton is None and ahocorasick is not None and self.bpe_codes:
+            self._automaton = ahocorasick.Automaton()
+            for token in self.get_tokens():
+                self._automaton.add_word(token, token)
+            self._automaton.make_automaton()
+        return self._automaton
 
     def encode(self, sentence):
         """
-        Encode a sentence by splitting it into words and encoding each word individually.
+        Encode a sentence by matching the longest merged tokens over the whole sentence in a
+        single pass, with an Aho-Corasick automaton when pyahocorasick is installed and a regex
+        scan otherwise. Characters not covered by a token are encoded on their own.
 
         Parameters:
             sentence (str): The sentence to be encoded.
@@ -105,11 +527,20 @@ class BPE:
         Returns:
             list: A list of encoded words from the sentence.
         """
+        automaton = self.get_automaton()
+        if automaton is None:
+            return self.get_pattern().findall(sentence)
+
         encoded_sentence = []
-        words = sentence.split()
-        for word in words:
-            encoded_word = self.encode_word(word)
-            encoded_sentence.extend(encoded_word)
+        start = 0
+        # iter_long drops a pending shorter match when the input ends inside a longer token,
+        # a trailing space settles it since tokens never contain whitespace
+        for end, token in automaton.iter_long(sentence + ' '):
+            # characters not covered by a token are encoded on their own
+            encoded_sentence.extend(''.join(sentence[start:end - len(token) + 1].split()))
+            encoded_sentence.append(token)
+            start = end + 1
+        encoded_sentence.extend(''.join(sentence[start:].split()))
         return encoded_sentence
 
     def encode_word(self, word):
@@ -122,52 +553,36 @@ class BPE:
         Returns:
             list: A list of subword units representing the encoded word.
         """
-        if word in self.bpe_codes.values():
-            return [word]
-
-        # Split the word into subword units
+        trie = self.get_trie()
         subwords = []
         i = 0
         while i < len(word):
-            found_subword = False
-            # Try to find the longest matching subword from the end of the word
-            for j in range(len(word), i, -1):
-                subword_candidate = word[i:j]
-                if subword_candidate in self.bpe_codes.values():
-                    subwords.append(subword_candidate)
-                    i = j
-                    found_subword = True
+            # Walk the trie remembering the end of the longest matching subword,
+            # falling back to a single character
+            node = trie
+            end = i + 1
+            for j in range(i, len(word)):
+                node = node.children.get(word[j])
+                if node is None:
                     break
-            if not found_subword:
-                subwords.append(word[i])
-                i += 1
+                if node.is_token:
+                    end = j + 1
+            subwords.append(word[i:end])
+            i = end
         return subwords
 
     def decode(self, encoded_sentence):
         """
-        Decode the given encoded sentence using the BPE codes.
+        Decode the given encoded sentence. Encoded tokens are already their surface form,
+        and since no end-of-word marker is used they are joined with spaces.
 
         Parameters:
-        - encoded_sentence (str): The sentence to be decoded.
+        - encoded_sentence (list): The tokens to be decoded.
 
         Returns:
         - str: The decoded sentence.
         """
-        decoded_sentence = []
-        i = 0
-        while i < len(encoded_sentence):
-            token = encoded_sentence[i]
-            if token in self.bpe_codes.values():
-                decoded_sentence.append(token)
-            else:
-                j = i + 1
-                while j < len(encoded_sentence) and encoded_sentence[j] in self.bpe_codes.values():
-                    token += encoded_sentence[j]
-                    j += 1
-                decoded_sentence.append(token)
-                i = j - 1
-            i += 1
-        return " ".join(decoded_sentence)
+        return " ".join(encoded_sentence)
 
     def save(self, file_path):
         """
@@ -177,11 +592,64 @@ class BPE:
         :type file_path: str
         """
         with open(file_path, "wb") as file:
-            pickle.dump((self.vocab, self.bpe_codes), file)
+            self.dump(file)
+
+    def dump(self, file):
+        """
+        Write the vocabulary and BPE codes to a binary file object as a zstd-compressed pickle.
+
+        :param file: The file object the data will be written to, left open.
+        """
+        import zstandard as zstd
+        with zstd.ZstdCompressor(level=3).stream_writer(file, closefd=False) as writer:
+            pickle.dump((self.vocab, self.bpe_codes), writer, protocol=pickle.HIGHEST_PROTOCOL)
 
     def save_to_s3(self, bucket_name, object_key):
         """
-        Save the contents of the file 'bpe_model.pkl' to an S3 bucket.
+        Save the vocabulary and BPE codes to an S3 bucket, streaming them from memory.
+
+        Parameters:
+            bucket_name (str): The name of the S3 bucket.
+            object_key (str): The key that identifies the object in the bucket.
+
+        Returns:
+            None
+        """
+        s3 = boto3.client('s3')
+        buffer = io.BytesIO()
+        self.dump(buffer)
+        buffer.seek(0)
+        s3.upload_fileobj(buffer, bucket_name, object_key)
+
+    def load(self, file_path):
+        """
+        Load the vocabulary and BPE codes from a file written by save.
+
+        :param file_path: The path to the file the data will be read from.
+        :type file_path: str
+        """
+        with open(file_path, "rb") as file:
+            self.read(file)
+
+    def read(self, file):
+        """
+        Read the vocabulary and BPE codes from a seekable binary file object written by dump.
+        Uncompressed pickles from earlier versions are read as they are.
+
+        :param file: The file object the data will be read from.
+        """
+        magic = file.read(4)
+        file.seek(0)
+        if magic != _ZSTD_MAGIC:
+            self.vocab, self.bpe_codes = pickle.load(file)
+            return
+        import zstandard as zstd
+        with zstd.ZstdDecompressor().stream_reader(file, closefd=False) as reader:
+            self.vocab, self.bpe_codes = pickle.load(reader)
+
+    def load_from_s3(self, bucket_name, object_key):
+        """
+        Load the vocabulary and BPE codes from an S3 bucket, streaming them into memory.
 
         Parameters:
             bucket_name (str): The name of the S3 bucket.
@@ -191,9 +659,10 @@ class BPE:
             None
         """
         s3 = boto3.client('s3')
-        with open("bpe_model.pkl", "wb") as file:
-            pickle.dump((self.vocab, self.bpe_codes), file)
-        s3.upload_file("bpe_model.pkl", bucket_name, object_key)
+        buffer = io.BytesIO()
+        s3.download_fileobj(bucket_name, object_key, buffer)
+        buffer.seek(0)
+        self.read(buffer)
 
     def get_vocab(self):
         """
@@ -228,8 +697,11 @@ class BPE:
         """
         num_unique_tokens = len(self.vocab)
         num_merges_performed = len(self.bpe_codes)
-        avg_encoded_token_length = sum(
-            len(token) for token in self.bpe_codes.values()) / num_merges_performed
+        stats_key = (id(self.bpe_codes), num_merges_performed)
+        if stats_key != self._stats_key:
+            self._total_token_len = sum(len(token) for token in self.bpe_codes.values())
+            self._stats_key = stats_key
+        avg_encoded_token_length = self._total_token_len / max(1, num_merges_performed)
 
         stats = {
             "num_unique_tokens": num_unique_tokens,
@@ -241,11 +713,12 @@ class BPE:
 
 
 if __name__ == '__main__':
-    from tqdm import tqdm
+    import mmap
     bpe = BPE()
-    with open('titles.txt', 'r') as f:
-        corpus = f.read().splitlines()
-    bpe.train(corpus[:3000000], max_merges=5000, vocab_size=10000000)
+    with open('titles.txt', 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lines = islice(iter(mm.readline, b''), 3000000)
+        corpus = (line.decode('utf-8', 'ignore') for line in lines)
+        bpe.train(corpus, max_merges=5000, vocab_size=10000000)
     sent = bpe.encode('software engineer')
     print(sent)
     # word = bpe.encode_word('software')
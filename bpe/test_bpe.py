@@ -0,0 +1,34 @@
+import pytest
+
+from bpe import BPE, ahocorasick
+
+# "cba" starts the longer token "cbab" but is cut off before its end
+SENTENCES = ["cba", "x cba", "cba y", "cbab", "bab cb", "c b a"]
+
+
+@pytest.fixture
+def bpe():
+    model = BPE()
+    model.train(["cbab"] * 5 + ["ba"] * 3 + ["bab"] * 2, vocab_size=100, max_merges=10, verbose=False)
+    return model
+
+
+def encode_words(model, sentence):
+    return [subword for word in sentence.split() for subword in model.encode_word(word)]
+
+
+def test_truncated_token(bpe):
+    assert set(bpe.bpe_codes.values()) == {"ba", "bab", "cbab"}
+    assert encode_words(bpe, "cba") == ["c", "ba"]
+
+
+@pytest.mark.skipif(ahocorasick is None, reason="pyahocorasick is not installed")
+@pytest.mark.parametrize("sentence", SENTENCES)
+def test_automaton_matches_encode_word(bpe, sentence):
+    assert bpe.get_automaton() is not None
+    assert bpe.encode(sentence) == encode_words(bpe, sentence)
+
+
+@pytest.mark.parametrize("sentence", SENTENCES)
+def test_pattern_matches_encode_word(bpe, sentence):
+    assert bpe.get_pattern().findall(sentence) == encode_words(bpe, sentence)